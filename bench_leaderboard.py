@@ -0,0 +1,69 @@
+"""Benchmark the row-by-row and columnar leaderboard parse on synthetic sheets.
+
+    python bench_leaderboard.py                    # 10k, 100k and 1M rows
+    python bench_leaderboard.py --sizes 50000 --limit 100
+
+For each size both paths rank the same rows and the results are checked to
+be identical before timings are printed.
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from leaderboard import parse_columns, rank_rows, top_k_indices
+
+
+def make_rows(n: int, seed: int = 0) -> list:
+    """Rows shaped like the sheet's: a few short rows, bad attempt counts and replayed score IDs."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(n):
+        ts = (start + timedelta(seconds=i * 7 + rng.randrange(7))).isoformat(timespec="seconds")
+        attempts = str(rng.randint(1, 10)) if rng.random() > 0.001 else "oops"
+        row = [f"player{rng.randrange(n // 10 + 1)}", attempts, ts, uuid.UUID(int=rng.getrandbits(128)).hex]
+        roll = rng.random()
+        if roll < 0.001:
+            row = row[:3]  # written before score IDs existed
+        elif roll < 0.002 and rows:
+            row = list(rows[-1])  # replayed append
+        rows.append(row)
+    return rows
+
+
+def columnar(rows: list, k: int) -> list:
+    columns = parse_columns(rows, set())
+    return [columns.score(i) for i in top_k_indices(columns.attempts, columns.timestamps, k)]
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated row counts")
+    parser.add_argument("--limit", type=int, default=10, help="top-K to select")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}  {'row loop':>10}  {'columnar':>10}  {'speedup':>7}")
+    for n in (int(size) for size in args.sizes.split(",")):
+        rows = make_rows(n)
+        expected = rank_rows(rows, set(), args.limit)
+        if columnar(rows, args.limit) != expected:
+            raise SystemExit(f"columnar result differs from the row loop at {n} rows")
+        loop_s = best_of(lambda: rank_rows(rows, set(), args.limit), args.repeat)
+        columnar_s = best_of(lambda: columnar(rows, args.limit), args.repeat)
+        print(f"{n:>10}  {loop_s * 1000:>8.1f}ms  {columnar_s * 1000:>8.1f}ms  {loop_s / columnar_s:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
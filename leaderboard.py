@@ -0,0 +1,537 @@
+"""Leaderboard parsing and ranking structures.
+
+Nothing here imports Streamlit or the Google client libraries, so the same
+code backs guess_the_number.py and bench_leaderboard.py.
+"""
+import bisect
+import copy
+import heapq
+import itertools
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+import numpy as np
+import pyarrow as pa
+
+# Batches smaller than this are parsed row by row; below it NumPy's per-call
+# overhead outweighs what it saves. First loads and large catch-ups go
+# through the columnar path.
+COLUMNAR_MIN_ROWS = 1000
+# RankIndex buckets attempt counts 0..RANK_MAX_ATTEMPTS; anything outside
+# (only possible for hand-edited rows) shares the nearest edge bucket.
+RANK_MAX_ATTEMPTS = 100
+_MAX_DIGITS = 18  # longest digit string that always fits in int64
+_INT64_MIN, _INT64_MAX = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+_NO_EPOCH = _INT64_MIN  # what NumPy's NaT becomes as int64; also marks unparsable timestamps
+SECONDS_PER_DAY = 86400
+# DailyRollups keeps this many UTC days, today included: the widest window
+# any board asks for. Older days are dropped.
+ROLLUP_RETAIN_DAYS = 7
+
+
+class Score(NamedTuple):
+    """One leaderboard entry."""
+
+    name: str
+    attempts: int
+    timestamp: str
+    score_id: str
+
+
+def parse_row(r: list, seen_ids: set):
+    """Turn one sheet row into a Score; None if its score ID was already seen."""
+    score_id = r[3] if len(r) > 3 else ""
+    if score_id:
+        # A retried or replayed append can land twice; count each win once
+        if score_id in seen_ids:
+            return None
+        seen_ids.add(score_id)
+    name = r[0] if len(r) > 0 else ""
+    attempts_str = r[1] if len(r) > 1 else "0"
+    ts = r[2] if len(r) > 2 else ""
+    try:
+        attempts = int(attempts_str)
+    except:
+        attempts = 0
+    return Score(name, attempts, ts, score_id)
+
+
+def rank_rows(rows: list, seen_ids: set, k: int) -> list:
+    """The ``k`` best new scores in ``rows``, parsed row by row and fully sorted."""
+    records = [s for s in (parse_row(r, seen_ids) for r in rows) if s is not None]
+    return sorted(records, key=lambda s: (s.attempts, s.timestamp))[:k]
+
+
+class ScoreColumns(NamedTuple):
+    """Sheet rows split into columns; ``attempts`` and ``timestamps`` are NumPy arrays."""
+
+    names: list
+    attempts: np.ndarray
+    timestamps: np.ndarray
+    score_ids: list
+
+    def score(self, i: int) -> Score:
+        return Score(self.names[i], int(self.attempts[i]), str(self.timestamps[i]), self.score_ids[i])
+
+
+def parse_columns(rows: list, seen_ids: set) -> ScoreColumns:
+    """Columnar parse_row() over many rows, dropping rows whose score ID was already seen."""
+    score_ids = [r[3] if len(r) > 3 else "" for r in rows]
+    keep = []
+    for i, score_id in enumerate(score_ids):
+        if score_id:
+            if score_id in seen_ids:
+                continue
+            seen_ids.add(score_id)
+        keep.append(i)
+    if len(keep) < len(rows):
+        rows = [rows[i] for i in keep]
+        score_ids = [score_ids[i] for i in keep]
+    return ScoreColumns(
+        names=[r[0] if len(r) > 0 else "" for r in rows],
+        attempts=_to_int64([r[1] if len(r) > 1 else "0" for r in rows]),
+        timestamps=np.array([r[2] if len(r) > 2 else "" for r in rows], dtype=str),
+        score_ids=score_ids,
+    )
+
+
+def _to_int64(values: list) -> np.ndarray:
+    """``int()`` every string in bulk, with 0 for unparsable ones as in parse_row().
+
+    Plain ASCII digit strings (all of them, in practice) are decoded straight
+    from the array's UCS-4 code points with a Horner pass per character
+    position. Anything else (signs, whitespace, other scripts' digits, junk)
+    goes through ``int()`` one by one. Values beyond int64 are clamped, which
+    is the one place the two parsers can differ.
+    """
+    strings = np.array(values, dtype=str)
+    n = len(strings)
+    width = strings.dtype.itemsize // 4
+    if n == 0 or width == 0:
+        return np.zeros(n, dtype=np.int64)
+    codes = strings.view(np.uint32).reshape(n, width)[:, :_MAX_DIGITS]
+    lengths = np.char.str_len(strings)
+    is_digit = (codes >= 48) & (codes <= 57)
+    plain = (lengths > 0) & (lengths <= _MAX_DIGITS) & (is_digit.sum(axis=1) == lengths)
+    out = np.zeros(n, dtype=np.int64)
+    digits = codes.astype(np.int64) - 48
+    for position in range(codes.shape[1]):
+        within = position < lengths
+        out[within] = out[within] * 10 + digits[within, position]
+    for i in np.flatnonzero(~plain):
+        out[i] = _int_or_zero(values[i])
+    return out
+
+
+def _int_or_zero(value: str) -> int:
+    try:
+        return min(max(int(value), _INT64_MIN), _INT64_MAX)
+    except ValueError:
+        return 0
+
+
+def parse_epoch(timestamp: str):
+    """Whole seconds since the Unix epoch for an ISO timestamp (naive means UTC); None if it does not parse."""
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _to_epochs(timestamps: np.ndarray) -> np.ndarray:
+    """parse_epoch() over an array, with _NO_EPOCH for timestamps that do not parse.
+
+    NumPy parses the values shaped like add_score()'s timestamps in one cast.
+    It is more lenient than parse_epoch() ("today", "2024", "20240101" all
+    parse), so every other value goes through parse_epoch(), as does the
+    whole batch if a well-shaped value is out of range (e.g. 2024-02-30).
+    """
+    epochs = np.full(len(timestamps), _NO_EPOCH, dtype=np.int64)
+    shaped = _iso_shaped(timestamps)
+    try:
+        epochs[shaped] = timestamps[shaped].astype("datetime64[s]").astype(np.int64)
+    except ValueError:
+        shaped[:] = False
+    for i in np.flatnonzero(~shaped):
+        epoch = parse_epoch(str(timestamps[i]))
+        if epoch is not None:
+            epochs[i] = epoch
+    return epochs
+
+
+def _iso_shaped(timestamps: np.ndarray) -> np.ndarray:
+    """Which values read YYYY-MM-DD, optionally followed by T or a space and HH:MM or HH:MM:SS.
+
+    Checked on the array's UCS-4 code points, like _to_int64().
+    """
+    n = len(timestamps)
+    width = timestamps.dtype.itemsize // 4
+    codes = np.zeros((n, 19), dtype=np.uint32)
+    if n and width:
+        codes[:, :min(width, 19)] = timestamps.view(np.uint32).reshape(n, width)[:, :19]
+    lengths = np.char.str_len(timestamps) if n else np.zeros(0, dtype=int)
+    digit = (codes >= 48) & (codes <= 57)
+    date = digit[:, [0, 1, 2, 3, 5, 6, 8, 9]].all(axis=1) & (codes[:, 4] == 45) & (codes[:, 7] == 45)
+    hours_minutes = (
+        ((codes[:, 10] == 84) | (codes[:, 10] == 32))
+        & digit[:, [11, 12, 14, 15]].all(axis=1)
+        & (codes[:, 13] == 58)
+    )
+    seconds = digit[:, [17, 18]].all(axis=1) & (codes[:, 16] == 58)
+    return date & (
+        (lengths == 10) | ((lengths == 16) & hours_minutes) | ((lengths == 19) & hours_minutes & seconds)
+    )
+
+
+def top_k_indices(attempts: np.ndarray, timestamps: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the ``k`` best rows by (attempts, timestamp, position), best first.
+
+    Selects with np.partition on attempts, then on timestamps among the rows
+    tied at the cutoff, and sorts only the selected rows, so the cost is
+    O(n + k log k) rather than a full sort.
+    """
+    n = len(attempts)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if n > k:
+        cutoff = np.partition(attempts, k - 1)[k - 1]
+        chosen = np.flatnonzero(attempts < cutoff)
+        tied = np.flatnonzero(attempts == cutoff)
+        need = k - len(chosen)
+        if len(tied) > need:
+            tied_ts = timestamps[tied]
+            ts_cutoff = np.partition(tied_ts, need - 1)[need - 1]
+            earlier = tied[tied_ts < ts_cutoff]
+            # Rows equal on both keys keep sheet order, as in a stable sort
+            same = tied[tied_ts == ts_cutoff][:need - len(earlier)]
+            tied = np.concatenate((earlier, same))
+        chosen = np.concatenate((chosen, tied))
+    else:
+        chosen = np.arange(n)
+    order = np.lexsort((chosen, timestamps[chosen], attempts[chosen]))
+    return chosen[order]
+
+
+def ingest(rows: list, seen_ids: set, indexes) -> None:
+    """Feed the new scores in ``rows`` to every index, column-wise for large batches.
+
+    Every new score ID is added to ``seen_ids``. Indexes implement
+    ``add(score)`` and ``add_columns(columns)``.
+    """
+    if len(rows) >= COLUMNAR_MIN_ROWS:
+        columns = parse_columns(rows, seen_ids)
+        for index in indexes:
+            index.add_columns(columns)
+        return
+    for r in rows:
+        score = parse_row(r, seen_ids)
+        if score is not None:
+            for index in indexes:
+                index.add(score)
+
+
+class TopScores:
+    """Bounded list of the best scores, kept sorted by (attempts, timestamp).
+
+    Equal scores keep their ingestion order, like the stable sort they
+    replace. Inserting is a binary search plus an O(capacity) list shift;
+    reading the top ``limit`` is a slice. ``version`` changes whenever the
+    ranking does.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._keys = []  # (attempts, timestamp, arrival) for each record, ascending
+        self._records = []
+        self._arrivals = 0  # a plain int rather than itertools.count, so snapshots can pickle it
+        self.version = 0
+
+    def add(self, record: Score, sort_key: tuple = None) -> bool:
+        """Insert ``record``; False if it does not make the top ``capacity``.
+
+        ``sort_key`` is the (attempts, time) pair to rank by; it defaults to
+        the record's own attempts and timestamp string.
+        """
+        self._arrivals += 1
+        key = (*(sort_key or (record.attempts, record.timestamp)), self._arrivals)
+        if len(self._keys) >= self._capacity and key > self._keys[-1]:
+            return False
+        i = bisect.bisect(self._keys, key)
+        self._keys.insert(i, key)
+        self._records.insert(i, record)
+        if len(self._keys) > self._capacity:
+            self._keys.pop()
+            self._records.pop()
+        self.version += 1
+        return True
+
+    def add_columns(self, columns: ScoreColumns):
+        """Add a parsed batch; only its own top ``capacity`` rows can make the ranking."""
+        for i in top_k_indices(columns.attempts, columns.timestamps, self._capacity):
+            self.add(columns.score(i))
+
+    def snapshot(self) -> tuple:
+        return tuple(self._records)
+
+    def copy(self) -> "TopScores":
+        """An independent copy; the records are immutable, so they are shared."""
+        other = copy.copy(self)
+        other._keys = self._keys.copy()
+        other._records = self._records.copy()
+        return other
+
+    def entries(self):
+        """(key, record) pairs, best first."""
+        return zip(self._keys, self._records)
+
+
+class _Fenwick:
+    """Binary indexed tree of counts over positions 0..size-1."""
+
+    def __init__(self, size: int):
+        self._tree = [0] * (size + 1)
+
+    def add(self, position: int, amount: int = 1):
+        i = position + 1
+        while i < len(self._tree):
+            self._tree[i] += amount
+            i += i & -i
+
+    def prefix(self, position: int) -> int:
+        """Total count at positions below ``position``."""
+        total, i = 0, position
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def copy(self) -> "_Fenwick":
+        other = copy.copy(self)
+        other._tree = self._tree.copy()
+        return other
+
+
+class RankIndex:
+    """Order statistics over every ingested score, for "your rank" lookups.
+
+    A Fenwick tree counts scores per attempt count, and each count keeps a
+    sorted list of its timestamps for the tiebreak, so rank() is O(log n).
+    add() is O(log n) too, plus a list insert that is an append for the
+    usual case of scores arriving in time order.
+    """
+
+    def __init__(self, max_attempts: int = RANK_MAX_ATTEMPTS):
+        self._max_attempts = max_attempts
+        self._counts = _Fenwick(max_attempts + 1)
+        self._timestamps = [[] for _ in range(max_attempts + 1)]
+        self.total = 0
+
+    def add(self, score: Score):
+        bucket = self._bucket(score.attempts)
+        self._counts.add(bucket)
+        bisect.insort(self._timestamps[bucket], score.timestamp)
+        self.total += 1
+
+    def add_columns(self, columns: ScoreColumns):
+        buckets = np.clip(columns.attempts, 0, self._max_attempts)
+        counts = np.bincount(buckets, minlength=self._max_attempts + 1)
+        order = np.lexsort((columns.timestamps, buckets))
+        sorted_ts = columns.timestamps[order].tolist()
+        start = 0
+        for bucket in np.flatnonzero(counts):
+            count = int(counts[bucket])
+            self._counts.add(int(bucket), count)
+            timestamps = self._timestamps[bucket]
+            timestamps.extend(sorted_ts[start:start + count])
+            timestamps.sort()  # two sorted runs: a linear merge for Timsort
+            start += count
+        self.total += len(columns.attempts)
+
+    def rank(self, attempts: int, timestamp: str) -> int:
+        """1-based rank of a score: one more than the number of strictly better scores."""
+        bucket = self._bucket(attempts)
+        return self._counts.prefix(bucket) + bisect.bisect_left(self._timestamps[bucket], timestamp) + 1
+
+    def copy(self) -> "RankIndex":
+        """An independent copy, sharing only the (immutable) timestamp strings."""
+        other = copy.copy(self)
+        other._counts = self._counts.copy()
+        other._timestamps = [timestamps.copy() for timestamps in self._timestamps]
+        return other
+
+    def _bucket(self, attempts: int) -> int:
+        return min(max(attempts, 0), self._max_attempts)
+
+
+class PlayerBests:
+    """Each player's best score, plus those bests kept sorted as a one-row-per-player ranking.
+
+    A player's best is their lowest attempt count, the earliest win breaking
+    ties. Looking one up is a dict hit; an improvement moves the player's
+    entry with a binary search and an O(players) list shift. ``version``
+    changes whenever the ranking does.
+    """
+
+    def __init__(self):
+        self._best = {}  # name -> (key, Score)
+        self._keys = []  # (attempts, timestamp, arrival) for each player's best, ascending
+        self._records = []
+        self._arrivals = 0  # a plain int rather than itertools.count, so snapshots can pickle it
+        self.version = 0
+
+    def add(self, score: Score) -> bool:
+        """Record ``score``; False if it does not beat the player's best."""
+        self._arrivals += 1
+        key = (score.attempts, score.timestamp, self._arrivals)
+        current = self._best.get(score.name)
+        if current is not None:
+            if key[:2] >= current[0][:2]:
+                return False
+            i = bisect.bisect_left(self._keys, current[0])
+            del self._keys[i]
+            del self._records[i]
+        i = bisect.bisect(self._keys, key)
+        self._keys.insert(i, key)
+        self._records.insert(i, score)
+        self._best[score.name] = (key, score)
+        self.version += 1
+        return True
+
+    def add_columns(self, columns: ScoreColumns):
+        """Add a parsed batch; only each player's best within the batch can be an improvement."""
+        if len(columns.names) == 0:
+            return
+        names = np.array(columns.names, dtype=str)
+        order = np.lexsort((np.arange(len(names)), columns.timestamps, columns.attempts, names))
+        sorted_names = names[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_names[1:] != sorted_names[:-1]
+        for i in np.sort(order[first]):  # sheet order, so equal scores keep it
+            self.add(columns.score(i))
+
+    def best(self, name: str):
+        """``name``'s best Score, or None if they have not won yet."""
+        current = self._best.get(name)
+        return None if current is None else current[1]
+
+    def rank(self, name: str):
+        """``name``'s 1-based place in the one-row-per-player ranking, or None."""
+        current = self._best.get(name)
+        return None if current is None else bisect.bisect_left(self._keys, current[0]) + 1
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def snapshot(self) -> tuple:
+        return tuple(self._records)
+
+    def copy(self) -> "PlayerBests":
+        """An independent copy; the records are immutable, so they are shared."""
+        other = copy.copy(self)
+        other._best = self._best.copy()
+        other._keys = self._keys.copy()
+        other._records = self._records.copy()
+        return other
+
+
+class DailyRollups:
+    """The best scores of each UTC day, for "today" and "last N days" boards.
+
+    Timestamps are parsed into epoch seconds once, on ingest, and each day
+    keeps its own TopScores ranked by (attempts, epoch). A window query
+    merges only the days it covers, so it costs O(days in window * limit)
+    however long the history is. Only the last ``retain_days`` days by
+    ``clock()`` are kept; scores from before them, and scores whose
+    timestamp does not parse, are left out.
+    """
+
+    def __init__(self, capacity: int, retain_days: int = ROLLUP_RETAIN_DAYS, clock=time.time):
+        self._capacity = capacity
+        self._retain_days = retain_days
+        self._clock = clock
+        self._days = {}  # UTC day number (epoch // SECONDS_PER_DAY) -> TopScores
+        self._first_day = None  # oldest day kept, as of the last prune
+        self.version = 0
+
+    def add(self, score: Score):
+        epoch = parse_epoch(score.timestamp)
+        if epoch is not None and epoch // SECONDS_PER_DAY >= self._prune():
+            self._add(score, epoch)
+
+    def add_columns(self, columns: ScoreColumns):
+        epochs = _to_epochs(columns.timestamps)
+        valid = np.flatnonzero((epochs != _NO_EPOCH) & (epochs // SECONDS_PER_DAY >= self._prune()))
+        days = epochs[valid] // SECONDS_PER_DAY
+        order = valid[np.argsort(days, kind="stable")]
+        bounds = np.flatnonzero(np.diff(np.sort(days))) + 1
+        for in_day in np.split(order, bounds):
+            if len(in_day) == 0:
+                continue
+            best = top_k_indices(columns.attempts[in_day], epochs[in_day], self._capacity)
+            for i in in_day[best]:
+                self._add(columns.score(i), int(epochs[i]))
+
+    def top(self, first_day: int, last_day: int, limit: int, per_player: bool = False) -> list:
+        """The best ``limit`` scores from UTC days ``first_day``..``last_day``, best first.
+
+        With ``per_player`` each name appears once, with their best score in the window.
+        """
+        boards = [self._days[day] for day in range(first_day, last_day + 1) if day in self._days]
+        merged = (record for _, record in heapq.merge(*(board.entries() for board in boards)))
+        if per_player:
+            names = set()
+            merged = (r for r in merged if not (r.name in names or names.add(r.name)))
+        return list(itertools.islice(merged, limit))
+
+    def copy(self) -> "DailyRollups":
+        other = copy.copy(self)
+        other._days = {day: board.copy() for day, board in self._days.items()}
+        return other
+
+    def _prune(self) -> int:
+        """Drop the days that have left the retained window; returns the oldest day kept."""
+        first_day = int(self._clock()) // SECONDS_PER_DAY - self._retain_days + 1
+        if first_day != self._first_day:
+            expired = [day for day in self._days if day < first_day]
+            for day in expired:
+                del self._days[day]
+            if expired:
+                self.version += 1
+            self._first_day = first_day
+        return first_day
+
+    def _add(self, score: Score, epoch: int):
+        day = epoch // SECONDS_PER_DAY
+        board = self._days.get(day)
+        if board is None:
+            board = self._days[day] = TopScores(self._capacity)
+        if board.add(score, (score.attempts, epoch)):
+            self.version += 1
+
+
+RANKING_SCHEMA = pa.schema([
+    ("rank", pa.int32()),
+    ("name", pa.string()),
+    ("attempts", pa.int64()),
+    ("timestamp", pa.string()),
+])
+
+
+def ranking_table(scores) -> pa.Table:
+    """Arrow table of ranked ``scores`` (best first), ready for st.dataframe.
+
+    ``table.slice(0, limit)`` is zero-copy, so one table serves every view size.
+    """
+    return pa.table(
+        [
+            pa.array(range(1, len(scores) + 1), type=pa.int32()),
+            pa.array([s.name for s in scores], type=pa.string()),
+            pa.array([s.attempts for s in scores], type=pa.int64()),
+            pa.array([s.timestamp for s in scores], type=pa.string()),
+        ],
+        schema=RANKING_SCHEMA,
+    )
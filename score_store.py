@@ -0,0 +1,776 @@
+"""Score persistence and incremental leaderboard state for guess_the_number.py.
+
+The write-behind score log, the host-wide copy of the sheet's rows and the
+per-tab leaderboard state. Nothing here imports Streamlit: the app builds
+one of each per process and supplies the file paths and the Sheets client.
+"""
+import atexit
+import fcntl
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+from leaderboard import (
+    SECONDS_PER_DAY,
+    DailyRollups,
+    PlayerBests,
+    RankIndex,
+    Score,
+    TopScores,
+    ingest,
+    parse_row,
+    ranking_table,
+)
+from sheets import RETRYABLE_STATUSES, SheetsClient, SheetsHTTPError, a1, execute_sheets_request
+
+logger = logging.getLogger(__name__)
+
+
+# ===============================
+# Score log + writer (write-behind)
+# ===============================
+# Every win is first committed to a local SQLite log (synchronous=FULL, so the
+# commit is fsync'd) and the player is acknowledged straight away. A
+# background thread replays the log to the sheet: it coalesces pending rows
+# into one multi-row append, flushed every FLUSH_INTERVAL_MS or as soon as
+# FLUSH_MAX_ROWS are waiting, and persists how far it got, so rows survive
+# Google outages and process crashes. Only one process per log file flushes
+# (the one holding an flock on the writer's lock file). The backlog is
+# bounded: when SCORE_BACKLOG_LIMIT rows are unflushed, submit() waits up to
+# ENQUEUE_TIMEOUT_S for the writer to catch up before giving up.
+FLUSH_INTERVAL_MS = 1000
+FLUSH_MAX_ROWS = 50
+SCORE_BACKLOG_LIMIT = 10_000
+SCORE_LOG_RETAIN = 10_000  # flushed rows kept in the log for inspection
+RECENT_SCORE_IDS = 10_000  # IDs the writer remembers as already appended
+ENQUEUE_TIMEOUT_S = 2.0
+RETRY_BACKOFF_MAX_S = 60.0
+
+
+class ScoreLog:
+    """Durable append-only log of score rows with a persisted replay cursor."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL, ts TEXT NOT NULL, score_id TEXT, difficulty TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {info[1] for info in self._conn.execute("PRAGMA table_info(scores)")}
+        if "score_id" not in columns:  # logs written before score IDs existed
+            self._conn.execute("ALTER TABLE scores ADD COLUMN score_id TEXT")
+        if "difficulty" not in columns:  # logs written before per-difficulty tabs; '' means RANGE_NAME
+            self._conn.execute("ALTER TABLE scores ADD COLUMN difficulty TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("UPDATE scores SET score_id = lower(hex(randomblob(16))) WHERE score_id IS NULL")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS scores_score_id ON scores (score_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def append(self, row: list) -> bool:
+        """Durably record one ``[name, attempts, ts, score_id, difficulty]`` row.
+
+        Returns False if a row with the same score ID is already logged, so
+        resubmitting a win is a no-op.
+        """
+        name, attempts, ts, score_id, difficulty = row
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO scores (name, attempts, ts, score_id, difficulty) VALUES (?, ?, ?, ?, ?)",
+                (name, int(attempts), ts, score_id, difficulty),
+            )
+            return cur.rowcount == 1
+
+    def cursor(self) -> int:
+        """Sequence number of the last row known to be in the sheet."""
+        with self._lock:
+            found = self._conn.execute("SELECT value FROM meta WHERE key = 'cursor'").fetchone()
+        return found[0] if found else 0
+
+    def pending(self, limit: int) -> list:
+        """Up to ``limit`` ``(seq, row)`` pairs that have not reached the sheet yet."""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT seq, name, attempts, ts, score_id, difficulty FROM scores"
+                " WHERE seq > COALESCE((SELECT value FROM meta WHERE key = 'cursor'), 0)"
+                " ORDER BY seq LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            (seq, [name, str(attempts), ts, score_id, difficulty])
+            for seq, name, attempts, ts, score_id, difficulty in found
+        ]
+
+    def backlog(self) -> int:
+        """Number of rows still waiting to be replayed."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM scores"
+                " WHERE seq > COALESCE((SELECT value FROM meta WHERE key = 'cursor'), 0)"
+            ).fetchone()[0]
+
+    def advance(self, seq: int):
+        """Persist that every row up to ``seq`` is in the sheet and prune old flushed rows."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('cursor', ?)"
+                    " ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                    (seq,),
+                )
+                self._conn.execute("DELETE FROM scores WHERE seq <= ?", (seq - SCORE_LOG_RETAIN,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class ScoreWriter:
+    """Background thread that replays the score log to the sheet in batched appends."""
+
+    def __init__(self, log: ScoreLog, append_rows, lock_path=None,
+                 interval_s=FLUSH_INTERVAL_MS / 1000, max_rows=FLUSH_MAX_ROWS,
+                 backlog_limit=SCORE_BACKLOG_LIMIT):
+        self._log = log
+        self._append_rows = append_rows
+        self._lock_path = lock_path
+        self._lock_file = None
+        self._interval_s = interval_s
+        self._max_rows = max_rows
+        self._backlog_limit = backlog_limit
+        self._recent_ids = OrderedDict()  # score IDs already appended, oldest first
+        self._wakeup = threading.Event()
+        self._drained = threading.Condition()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="score-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, row: list, timeout: float = ENQUEUE_TIMEOUT_S) -> bool:
+        """Durably log one row; returns False if the backlog stayed full for ``timeout`` seconds.
+
+        Submitting a score ID that is already logged succeeds without adding
+        a row. Errors writing the local log propagate to the caller.
+        """
+        if self._closed.is_set():
+            return False
+        deadline = time.monotonic() + timeout
+        with self._drained:
+            while self._log.backlog() >= self._backlog_limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._drained.wait(remaining)
+        if self._log.append(row):
+            self._wakeup.set()
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """Stop accepting rows and make a last attempt to flush the backlog (called at exit)."""
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        delay = 0.0
+        while not self._closed.is_set():
+            if delay:
+                self._closed.wait(delay)  # back off after a failure; new wins do not cut it short
+            else:
+                self._wakeup.wait(self._interval_s)
+            self._wakeup.clear()
+            if self._closed.is_set() or not self._is_leader():
+                continue
+            # Give a burst a moment to accumulate, unless a full batch is already waiting
+            if self._log.backlog() < self._max_rows:
+                self._closed.wait(self._interval_s)
+            delay = self._flush_pending(delay)
+        if self._is_leader():
+            self._flush_pending(0.0)
+
+    def _is_leader(self) -> bool:
+        """Whether this process holds the log's flush lock (taken on first success)."""
+        if self._lock_file is not None or self._lock_path is None:
+            return True
+        handle = open(self._lock_path, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        return True
+
+    def _flush_pending(self, delay: float) -> float:
+        """Replay the whole backlog; returns the retry delay to use next (0 when caught up)."""
+        while True:
+            batch = self._log.pending(self._max_rows)
+            if not batch:
+                return 0.0
+            by_difficulty = {}
+            for _, row in batch:
+                if row[3] not in self._recent_ids:
+                    by_difficulty.setdefault(row[4], []).append(row)
+            for difficulty, rows in by_difficulty.items():
+                try:
+                    self._append_rows(difficulty, rows)
+                except Exception:
+                    logger.exception("Failed to append %d score(s) to the sheet; will retry", len(rows))
+                    return min(max(delay * 2, self._interval_s), RETRY_BACKOFF_MAX_S)
+                self._remember([row[3] for row in rows])
+            self._log.advance(batch[-1][0])
+            with self._drained:
+                self._drained.notify_all()
+
+    def _remember(self, score_ids: list):
+        for score_id in score_ids:
+            self._recent_ids[score_id] = None
+        while len(self._recent_ids) > RECENT_SCORE_IDS:
+            self._recent_ids.popitem(last=False)
+
+
+# ===============================
+# Leaderboard state (incremental)
+# ===============================
+# Each process keeps, per tab, the indexes of leaderboard.py over every score
+# it has ingested and a cursor of the sheet rows they cover, so a refresh
+# only reads the rows below it. Its own wins are ranked at once and its own
+# appends are ingested from the append response. Everyone else's arrive
+# through stale-while-revalidate: past LEADERBOARD_TTL_S a background thread
+# refreshes while renders keep serving the current data, and a render only
+# waits on a cold start or past LEADERBOARD_MAX_STALENESS_S. Failed reads
+# keep the last good data; BREAKER_FAILURES in a row pause reads for
+# BREAKER_COOLDOWN_S.
+#
+# Refreshes go through SharedRows, a SQLite copy of each tab's rows shared by
+# the processes on a host. Only the holder of a tab's refresher flock reads
+# Sheets, and it skips the read while the tab's generation is unchanged (for
+# up to GENERATION_MAX_SKIP_S). Each state is also snapshotted to a local
+# file, so a restarted process serves the snapshot at once and only reads
+# the rows appended since.
+TOP_K_CAPACITY = 1000
+LEADERBOARD_TTL_S = 30
+LEADERBOARD_MAX_STALENESS_S = 300
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN_S = 30
+SNAPSHOT_INTERVAL_S = 60
+GENERATION_MAX_SKIP_S = 300
+SNAPSHOT_FORMAT = 3  # bump when the pickled state changes shape; older snapshots are ignored
+
+# One row per leaderboard tab (tab name, generation). Each generation is a
+# formula over its tab, so Sheets changes it on every append without the
+# writers sending a second request; a reader that sees the same generation
+# as at its last fetch knows no rows were added in between.
+GENERATION_TAB = "Generations"
+GENERATION_HEADER = ["Tab", "Generation"]
+
+
+def generation_formula(tab: str) -> str:
+    """Formula for ``tab``'s generation: its row count and the score ID in its last row."""
+    rows = f"COUNTA({a1(tab, 'A:A')})"
+    return f'={rows}&"/"&INDEX({a1(tab, "D:D")},{rows})'
+
+
+def read_generations(client: SheetsClient) -> dict:
+    """Current generation of each score tab (tabs with no row are left out)."""
+    result = execute_sheets_request(lambda: client.get_values(a1(GENERATION_TAB, "A2:B")), "read")
+    return {row[0]: (row[1] if len(row) > 1 else "") for row in result.get("values", []) if row}
+
+
+def _first_row(a1_range: str):
+    """First row number of an A1 range such as ``Sheet1!A12:D14`` (None if absent)."""
+    match = re.search(r"!\$?[A-Z]*\$?(\d+)", a1_range)
+    return int(match.group(1)) if match else None
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of contacting Sheets while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe per cooldown."""
+
+    def __init__(self, threshold: int = BREAKER_FAILURES, cooldown_s: float = BREAKER_COOLDOWN_S):
+        self._threshold = threshold
+        self._cooldown_s = cooldown_s
+        self._failures = 0
+        self._opened_at = None  # time.monotonic() when the circuit last opened (or probed)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; while open, lets one probe through per cooldown."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self._cooldown_s:
+                return False
+            self._opened_at = time.monotonic()  # this caller is the probe
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self._threshold:
+                if self._opened_at is None:
+                    logger.warning("Sheets reads failing; pausing them for %ss", self._cooldown_s)
+                self._opened_at = time.monotonic()
+
+
+class SharedRows:
+    """Host-wide SQLite copy of each tab's sheet rows, with when each tab was last read from Sheets.
+
+    Rows are stored by sheet row number and only ever added as a block that
+    starts right below the highest stored row, so every tab's rows are
+    contiguous from row 2.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_rows ("
+            " tab TEXT NOT NULL, row INTEGER NOT NULL, name TEXT NOT NULL, attempts TEXT NOT NULL,"
+            " ts TEXT NOT NULL, score_id TEXT NOT NULL, difficulty TEXT NOT NULL, PRIMARY KEY (tab, row))"
+            " WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_reads (tab TEXT PRIMARY KEY, refreshed_at REAL, error TEXT)"
+        )
+        columns = {info[1] for info in self._conn.execute("PRAGMA table_info(sheet_reads)")}
+        if "generation" not in columns:  # caches written before generation checks
+            self._conn.execute("ALTER TABLE sheet_reads ADD COLUMN generation TEXT")
+            self._conn.execute("ALTER TABLE sheet_reads ADD COLUMN fetched_at REAL")
+
+    def cursor(self, tab: str) -> int:
+        """Highest sheet row stored for ``tab`` (1, the header, when there are none)."""
+        with self._lock:
+            found = self._conn.execute("SELECT MAX(row) FROM sheet_rows WHERE tab = ?", (tab,)).fetchone()
+        return found[0] or 1
+
+    def read(self, tab: str, start: int):
+        """``(rows from sheet row start on, refreshed_at, error)`` for ``tab``.
+
+        ``refreshed_at`` is the wall-clock time of the last successful read
+        from Sheets (None if there has been none) and ``error`` the message
+        of the last failed one since.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                found = self._conn.execute(
+                    "SELECT name, attempts, ts, score_id, difficulty FROM sheet_rows"
+                    " WHERE tab = ? AND row >= ? ORDER BY row",
+                    (tab, start),
+                ).fetchall()
+                status = self._conn.execute(
+                    "SELECT refreshed_at, error FROM sheet_reads WHERE tab = ?", (tab,)
+                ).fetchone()
+            finally:
+                self._conn.execute("COMMIT")
+        refreshed_at, error = status or (None, None)
+        return [list(row) for row in found], refreshed_at, error
+
+    def store(self, tab: str, start: int, rows: list, refreshed: bool = False, generation: str = None) -> bool:
+        """Add ``rows`` as sheet rows ``start``.. of ``tab`` if they continue the stored ones.
+
+        With ``refreshed`` the rows are a fresh read of everything from
+        ``start`` on, so the tab is also marked as read from Sheets now,
+        with ``generation`` as the generation seen just before that read.
+        Returns whether the rows were stored.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                found = self._conn.execute("SELECT MAX(row) FROM sheet_rows WHERE tab = ?", (tab,)).fetchone()
+                cursor = found[0] or 1
+                # Skip rows another process stored since this read started
+                new_rows = rows[cursor + 1 - start:] if start <= cursor + 1 else None
+                if new_rows:
+                    self._conn.executemany(
+                        "INSERT INTO sheet_rows (tab, row, name, attempts, ts, score_id, difficulty)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (tab, cursor + 1 + i, *(list(r[:5]) + [""] * (5 - len(r[:5]))))
+                            for i, r in enumerate(new_rows)
+                        ],
+                    )
+                if refreshed and new_rows is not None:
+                    now = time.time()
+                    self._conn.execute(
+                        "INSERT INTO sheet_reads (tab, refreshed_at, error, generation, fetched_at)"
+                        " VALUES (?, ?, NULL, ?, ?)"
+                        " ON CONFLICT(tab) DO UPDATE SET refreshed_at = excluded.refreshed_at, error = NULL,"
+                        " generation = excluded.generation, fetched_at = excluded.fetched_at",
+                        (tab, now, generation, now),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return new_rows is not None
+
+    def unchanged(self, tab: str, generation: str, max_age: float) -> bool:
+        """Whether ``generation`` is the one seen at ``tab``'s last fetch, made under ``max_age`` s ago.
+
+        If so the tab is marked as read from Sheets now, as a fetch would
+        have found nothing new.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._conn.execute(
+                    "UPDATE sheet_reads SET refreshed_at = ?, error = NULL"
+                    " WHERE tab = ? AND generation = ? AND fetched_at > ?",
+                    (time.time(), tab, generation, time.time() - max_age),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount == 1
+
+    def record_error(self, tab: str, error: str):
+        """Note that reading ``tab`` from Sheets failed, for the other processes to show."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sheet_reads (tab, refreshed_at, error) VALUES (?, NULL, ?)"
+                " ON CONFLICT(tab) DO UPDATE SET error = excluded.error",
+                (tab, error),
+            )
+
+    @contextmanager
+    def refresher(self, tab: str):
+        """Hold ``tab``'s refresher lock, waiting while another process reads it from Sheets."""
+        with open(f"{self._path}.{tab}.lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class LeaderboardState:
+    """Index of the scores ingested from one difficulty's tab so far, plus its row cursor."""
+
+    def __init__(self, tab: str, shared: SharedRows, snapshot_path: str = None):
+        self.tab = tab
+        self.shared = shared
+        self.snapshot_path = snapshot_path
+        self.rows_ingested = 1  # the header row is never a score
+        self.top_scores = TopScores(TOP_K_CAPACITY)
+        self.ranks = RankIndex()
+        self.player_bests = PlayerBests()
+        self.daily = DailyRollups(TOP_K_CAPACITY)
+        self._indexes = (self.top_scores, self.ranks, self.player_bests, self.daily)
+        # Arrow snapshots handed to readers, each with the index version it was built from
+        self._rankings = {
+            board: (ranking_table(()), board.version) for board in (self.top_scores, self.player_bests)
+        }
+        self._snapshot_lock = threading.Lock()  # one save at a time, so they share the temp file
+        self._snapshot_at = None  # time.monotonic() of the last save
+        self._snapshot_cursor = self.rows_ingested  # rows_ingested as of the last save or load
+        self._seen_ids = set()
+        self._refreshed_at = None  # time.monotonic() of the last successful read from Sheets, by any process
+        self.last_error = None  # exception from the latest refresh attempt, None once one succeeds
+        self._breaker = CircuitBreaker()
+        self._lock = threading.Lock()  # guards the index; never held across a request
+        self._in_flight = threading.Lock()  # held by the one caller currently fetching
+
+    def refresh(self, get_client, max_age: float = 0.0):
+        """Ingest the rows appended since the last refresh, unless the data is under ``max_age`` s old.
+
+        New rows come from the host-shared copy. Only if that is stale too
+        is Sheets read, through the client ``get_client()`` returns (it is
+        only called then, so building it never delays a refresh that does
+        not need it), by whichever process holds the tab's refresher lock;
+        the others wait for it and ingest what it stored. Concurrent callers
+        in this process are coalesced the same way. If the read fails, only
+        the caller that sent it sees the error; the others keep the previous
+        state. While the circuit breaker is open this raises
+        CircuitOpenError without contacting Sheets or waiting for the lock.
+        The breaker is checked and the client built before the lock is
+        taken, so a slow build never holds up the other processes.
+        """
+        if self._is_fresh(max_age):
+            return
+        if not self._in_flight.acquire(blocking=False):
+            with self._in_flight:  # wait for the in-flight refresh
+                return
+        try:
+            self._catch_up()
+            if self._is_fresh(max_age):
+                return
+            client = self._client(get_client)
+            with self.shared.refresher(self.tab):
+                self._catch_up()  # another process may have read Sheets while we waited
+                if self._is_fresh(max_age):
+                    self._breaker.record_success()  # its read got through, so ours would have
+                else:
+                    self._read_sheet(client)
+            self._catch_up()
+        finally:
+            self._in_flight.release()
+        if self._snapshot_due():
+            threading.Thread(target=self._save_quietly, name="leaderboard-snapshot", daemon=True).start()
+
+    def refresh_in_background(self, get_client, max_age: float = 0.0):
+        """Start refresh() on a daemon thread, unless one is already in flight."""
+        if self._in_flight.locked():
+            return
+        threading.Thread(
+            target=self._refresh_quietly, args=(get_client, max_age), name="leaderboard-refresh", daemon=True
+        ).start()
+
+    def age(self):
+        """Seconds since the data was last read from Sheets (None before the first read)."""
+        refreshed_at = self._refreshed_at
+        return None if refreshed_at is None else time.monotonic() - refreshed_at
+
+    def _client(self, get_client):
+        """``get_client()``, unless the circuit breaker is open.
+
+        Failing to build the client counts as a failed read, so the breaker
+        also stops repeated builds during an outage.
+        """
+        if not self._breaker.allow():
+            raise CircuitOpenError("Google Sheets reads are paused after repeated failures; retrying shortly.")
+        try:
+            return get_client()
+        except Exception as e:
+            self._record_failure(e)
+            raise
+
+    def _read_sheet(self, client):
+        """Read the rows below the shared copy's cursor from Sheets and store them there.
+
+        Only the tab's generation is read if it shows nothing was appended
+        since the last fetch.
+        """
+        try:
+            generation = self._read_generation(client)
+            if generation is not None and self.shared.unchanged(self.tab, generation, GENERATION_MAX_SKIP_S):
+                self._breaker.record_success()
+                return
+            start = self.shared.cursor(self.tab) + 1
+            range_name = a1(self.tab, f"A{start}:E")
+            result = execute_sheets_request(lambda: client.get_values(range_name), "read")
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        self._breaker.record_success()
+        self.shared.store(self.tab, start, result.get("values", []), refreshed=True, generation=generation)
+
+    def _record_failure(self, error: Exception):
+        self.last_error = error
+        self._breaker.record_failure()
+        self.shared.record_error(self.tab, str(error))
+
+    def _read_generation(self, client):
+        """The tab's generation, or None if the sheet has none for it (then the rows are fetched anyway).
+
+        A request Sheets rejects, e.g. for a missing generation tab, is not
+        an outage and so is not passed on to the breaker; transient errors are.
+        """
+        try:
+            return read_generations(client).get(self.tab)
+        except SheetsHTTPError as e:
+            if e.status in RETRYABLE_STATUSES:
+                raise
+            logger.warning("Could not read the generation of %s; fetching it in full: %s", self.tab, e)
+            return None
+
+    def _catch_up(self):
+        """Ingest the shared copy's rows below this process's cursor."""
+        with self._lock:
+            start = self.rows_ingested + 1
+        rows, refreshed_at, error = self.shared.read(self.tab, start)
+        with self._lock:
+            # record_append() may have moved the cursor while we were reading
+            self._ingest(rows[self.rows_ingested + 1 - start:])
+            if refreshed_at is not None:
+                self._refreshed_at = time.monotonic() - max(0.0, time.time() - refreshed_at)
+        if error is None:
+            self.last_error = None
+        elif self.last_error is None:
+            self.last_error = RuntimeError(error)
+
+    def _is_fresh(self, max_age: float) -> bool:
+        age = self.age()
+        return age is not None and age < max_age
+
+    def _refresh_quietly(self, get_client, max_age: float):
+        try:
+            self.refresh(get_client, max_age)
+        except CircuitOpenError:
+            pass
+        except Exception:
+            logger.exception("Background leaderboard refresh failed")
+
+    def record_local(self, row: list):
+        """Rank a score logged by this process before it reaches the sheet.
+
+        Its score ID is remembered, so reading the row back later does not
+        count it twice; the row cursor is untouched. Returns the Score, or
+        None if it was already ingested.
+        """
+        with self._lock:
+            score = parse_row(row, self._seen_ids)
+            if score is not None:
+                for index in self._indexes:
+                    index.add(score)
+            return score
+
+    def rank(self, score: Score):
+        """(rank, total) of ``score`` among every score ingested so far; no Sheets read."""
+        with self._lock:
+            return self.ranks.rank(score.attempts, score.timestamp), self.ranks.total
+
+    def personal_best(self, name: str):
+        """(best Score, place among players, number of players) for ``name``, or None if they have no wins."""
+        with self._lock:
+            best = self.player_bests.best(name)
+            if best is None:
+                return None
+            return best, self.player_bests.rank(name), len(self.player_bests)
+
+    def record_append(self, rows: list, result: dict):
+        """Ingest rows this process appended, if they sit directly below the cursor.
+
+        Otherwise another writer got rows in between, and the next refresh
+        picks up everything in order. The rows also go to the shared copy
+        when they continue it.
+        """
+        first_row = _first_row(result.get("updates", {}).get("updatedRange", ""))
+        if first_row is None:
+            return
+        with self._lock:
+            if first_row == self.rows_ingested + 1:
+                self._ingest(rows)
+        try:
+            self.shared.store(self.tab, first_row, rows)
+        except sqlite3.Error as e:  # only an optimisation; the rows are in the sheet either way
+            logger.warning("Could not add appended rows to the shared leaderboard cache: %s", e)
+
+    def top(self, limit: int, per_player: bool = False) -> pa.Table:
+        """The best ``limit`` scores, as a zero-copy slice of the shared Arrow ranking.
+
+        With ``per_player`` each name appears once, with their best score.
+        """
+        board = self.player_bests if per_player else self.top_scores
+        ranking, version = self._rankings[board]
+        if version != board.version:
+            with self._lock:
+                ranking, version = self._rankings[board]
+                if version != board.version:
+                    ranking = ranking_table(board.snapshot())
+                    self._rankings[board] = (ranking, board.version)
+        return ranking.slice(0, limit)
+
+    def save_snapshot(self):
+        """Write the ingested state to ``snapshot_path`` atomically.
+
+        The lock is only held to copy the state, which copies references
+        rather than scores; pickling and writing it happen outside, so
+        renders are not held up by a save.
+        """
+        with self._lock:
+            age = self.age()
+            state = {
+                "format": SNAPSHOT_FORMAT,
+                "tab": self.tab,
+                # wall clock of the last read from Sheets, not of this save
+                "refreshed_at": None if age is None else time.time() - age,
+                "rows_ingested": self.rows_ingested,
+                "seen_ids": self._seen_ids.copy(),
+                "indexes": tuple(index.copy() for index in self._indexes),
+            }
+            cursor = self.rows_ingested
+        payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with self._snapshot_lock:
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._snapshot_at = time.monotonic()
+            self._snapshot_cursor = cursor
+
+    def load_snapshot(self) -> bool:
+        """Replace the state with the one saved at ``snapshot_path``; False if there is none usable.
+
+        The loaded data counts as refreshed when the saving process last read
+        from Sheets, so the usual TTL and staleness rules decide how soon it
+        is caught up, however recently the snapshot was written.
+        """
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning("Ignoring unreadable leaderboard snapshot %s: %s", self.snapshot_path, e)
+            return False
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("tab") != self.tab:
+            return False
+        with self._lock:
+            self.rows_ingested = snapshot["rows_ingested"]
+            self._seen_ids = snapshot["seen_ids"]
+            self._indexes = snapshot["indexes"]
+            self.top_scores, self.ranks, self.player_bests, self.daily = self._indexes
+            # version -1 never matches, so both rankings are rebuilt on first use
+            self._rankings = {board: (ranking_table(()), -1) for board in (self.top_scores, self.player_bests)}
+            refreshed_at = snapshot["refreshed_at"]
+            if refreshed_at is None:
+                self._refreshed_at = None
+            else:
+                self._refreshed_at = time.monotonic() - max(0.0, time.time() - refreshed_at)
+            self._snapshot_cursor = self.rows_ingested
+        logger.info("Loaded leaderboard snapshot for %s: %d rows, %s", self.tab, self.rows_ingested,
+                    "never refreshed" if refreshed_at is None else f"refreshed {time.time() - refreshed_at:.0f} s ago")
+        return True
+
+    def close(self):
+        """Snapshot any rows ingested since the last save; registered to run at exit."""
+        if self._snapshot_due(min_interval=0):
+            self._save_quietly()
+
+    def _snapshot_due(self, min_interval: float = SNAPSHOT_INTERVAL_S) -> bool:
+        if self.snapshot_path is None or self.rows_ingested == self._snapshot_cursor:
+            return False
+        return self._snapshot_at is None or time.monotonic() - self._snapshot_at >= min_interval
+
+    def _save_quietly(self):
+        try:
+            self.save_snapshot()
+        except Exception:
+            logger.exception("Saving the leaderboard snapshot failed")
+
+    def window(self, days: int, limit: int, per_player: bool = False) -> pa.Table:
+        """The best ``limit`` scores won in the last ``days`` UTC days, today included."""
+        today = int(time.time()) // SECONDS_PER_DAY
+        with self._lock:
+            scores = self.daily.top(today - days + 1, today, limit, per_player)
+        return ranking_table(scores)
+
+    def _ingest(self, rows: list):
+        ingest(rows, self._seen_ids, self._indexes)
+        self.rows_ingested += len(rows)
@@ -0,0 +1,286 @@
+"""Optional sidecar that owns all Google Sheets I/O for the app processes on a host.
+
+    python sheets_sidecar.py --socket /run/gtn/sheets.sock
+    GTN_SIDECAR_SOCKET=/run/gtn/sheets.sock streamlit run guess_the_number.py
+    python sheets_sidecar.py --socket /run/gtn/sheets.sock --stats
+
+The sidecar holds the only credentials and Sheets connection pool on the
+host, so its token buckets are the host's quota. Appends to the same range
+that arrive within --batch-window-ms are sent as one request, and reads are
+answered from a short-lived cache that appends to the same tab invalidate.
+The protocol is described in sheets.py; app processes that cannot reach the
+socket call Sheets themselves.
+"""
+import argparse
+import inspect
+import json
+import logging
+import os
+import re
+import socket
+import socketserver
+import sys
+import threading
+import time
+import tomllib
+from collections import Counter, OrderedDict
+
+from sheets import (
+    SIDECAR_OPS,
+    SheetsHTTPError,
+    SidecarClient,
+    build_client,
+    execute_sheets_request,
+    recv_message,
+    send_message,
+    validated_sa_info,
+)
+
+logger = logging.getLogger("sheets_sidecar")
+
+READ_CACHE_TTL_S = 2.0
+READ_CACHE_ENTRIES = 64
+BATCH_WINDOW_MS = 200
+_UPDATED_RANGE = re.compile(r"^(?P<sheet>.*!)(?P<col1>[A-Z]*)(?P<row1>\d+)(?::(?P<col2>[A-Z]*)(?P<row2>\d+))?$")
+
+
+class _Batch:
+    def __init__(self):
+        self.rows = []
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class AppendBatcher:
+    """Sends the append_values() calls for one range that arrive within ``window_s`` as one request.
+
+    The first caller waits out the window and sends the batch; every caller
+    then gets back an append response narrowed to its own rows.
+    """
+
+    def __init__(self, send, window_s: float):
+        self._send = send
+        self._window_s = window_s
+        self._open = {}  # range name -> _Batch still accepting rows
+        self._lock = threading.Lock()
+
+    def append(self, range_name: str, rows: list) -> dict:
+        with self._lock:
+            batch = self._open.get(range_name)
+            sender = batch is None
+            if sender:
+                batch = self._open[range_name] = _Batch()
+            offset = len(batch.rows)
+            batch.rows.extend(rows)
+        if sender:
+            time.sleep(self._window_s)
+            with self._lock:
+                del self._open[range_name]
+            try:
+                batch.result = self._send(range_name, batch.rows)
+            except Exception as e:
+                batch.error = e
+            batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return _narrowed(batch.result, offset, len(rows))
+
+
+def _narrowed(result: dict, offset: int, count: int) -> dict:
+    """The append response ``result`` as if only rows ``offset``..``offset + count - 1`` had been sent."""
+    updates = dict(result.get("updates", {}))
+    match = _UPDATED_RANGE.match(updates.get("updatedRange", ""))
+    if match:
+        first = int(match["row1"]) + offset
+        col2 = match["col2"] if match["col2"] is not None else match["col1"]
+        updates["updatedRange"] = f"{match['sheet']}{match['col1']}{first}:{col2}{first + count - 1}"
+    updates["updatedRows"] = count
+    return {**result, "updates": updates}
+
+
+class Sidecar:
+    """Executes protocol requests against one SheetsClient, counting every call."""
+
+    def __init__(self, client, batch_window_s: float = BATCH_WINDOW_MS / 1000):
+        self._client = client
+        self._batcher = AppendBatcher(self._send_append, batch_window_s)
+        self._reads = OrderedDict()  # range name -> (time.monotonic() fetched, result)
+        self._reads_lock = threading.Lock()
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._started = time.time()
+
+    def handle(self, request: dict) -> dict:
+        """The reply to one protocol request.
+
+        Errors keep Sheets' own status and message. A malformed request is a
+        400, which the app does not retry; quota deadlines and network
+        errors are a retryable 503.
+        """
+        op = request.get("op")
+        if op not in SIDECAR_OPS:
+            return {"error": {"status": 400, "message": f"unknown op {op!r}"}}
+        self._count(f"requests.{op}")
+        method = getattr(self, f"_{op}")
+        args = request.get("args", [])
+        try:
+            if not isinstance(args, list):
+                raise TypeError("args must be a list")
+            inspect.signature(method).bind(*args)
+        except TypeError as e:
+            return self._error(400, f"bad request for {op}: {e}")
+        try:
+            return {"result": method(*args)}
+        except SheetsHTTPError as e:
+            return self._error(e.status, e.message, e.retry_after)
+        except (TimeoutError, OSError) as e:
+            return self._error(503, f"sidecar: {e}")
+        except (TypeError, ValueError, KeyError) as e:  # arguments of the right number but the wrong shape
+            return self._error(400, f"bad request for {op}: {e}")
+        except Exception as e:
+            logger.exception("Handling %s failed", op)
+            return self._error(500, f"sidecar: {e}")
+
+    def _get_values(self, range_name: str) -> dict:
+        with self._reads_lock:
+            cached = self._reads.get(range_name)
+        if cached is not None and time.monotonic() - cached[0] < READ_CACHE_TTL_S:
+            self._count("reads.cached")
+            return cached[1]
+        result = self._sheets("read", lambda: self._client.get_values(range_name))
+        with self._reads_lock:
+            self._reads[range_name] = (time.monotonic(), result)
+            self._reads.move_to_end(range_name)
+            while len(self._reads) > READ_CACHE_ENTRIES:
+                self._reads.popitem(last=False)
+        return result
+
+    def _batch_get_values(self, range_names: list, value_render_option: str = "FORMATTED_VALUE") -> dict:
+        return self._sheets("read", lambda: self._client.batch_get_values(range_names, value_render_option))
+
+    def _get_sheet_ids(self) -> dict:
+        return self._sheets("read", self._client.get_sheet_ids)
+
+    def _update_values(self, range_name: str, rows: list, value_input_option: str = "RAW") -> dict:
+        self._forget_reads(range_name)
+        return self._sheets("write", lambda: self._client.update_values(range_name, rows, value_input_option))
+
+    def _batch_update(self, requests: list) -> dict:
+        self._forget_reads()
+        return self._sheets("write", lambda: self._client.batch_update(requests))
+
+    def _append_values(self, range_name: str, rows: list) -> dict:
+        self._count("rows.appended", len(rows))
+        return self._batcher.append(range_name, rows)
+
+    def _error(self, status: int, message: str, retry_after: float = 0.0) -> dict:
+        self._count("errors")
+        return {"error": {"status": status, "message": message, "retry_after": retry_after}}
+
+    def _stats(self) -> dict:
+        with self._counts_lock:
+            counts = dict(self._counts)
+        return {"uptime_s": round(time.time() - self._started), **counts}
+
+    def _send_append(self, range_name: str, rows: list) -> dict:
+        self._forget_reads()  # formulas on other tabs, such as the app's generations, may depend on this one
+        return self._sheets("write", lambda: self._client.append_values(range_name, rows))
+
+    def _sheets(self, kind: str, call):
+        """One Sheets request under the host's quota, counted by kind."""
+        def counted():
+            self._count(f"sheets.{kind}s")
+            return call()
+
+        return execute_sheets_request(counted, kind)
+
+    def _forget_reads(self, range_name: str = None):
+        """Drop cached reads of the tab ``range_name`` is on (every tab if None), so the write is visible at once."""
+        sheet = "" if range_name is None else range_name.rsplit("!", 1)[0] + "!"
+        with self._reads_lock:
+            for cached in [r for r in self._reads if r.startswith(sheet)]:
+                del self._reads[cached]
+
+    def _count(self, key: str, amount: int = 1):
+        with self._counts_lock:
+            self._counts[key] += amount
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (OSError, ValueError) as e:
+                logger.warning("Dropping client connection: %s", e)
+                return
+            if request is None:
+                return
+            send_message(self.request, self.server.sidecar.handle(request))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def load_secrets(path: str) -> dict:
+    """The validated [google_service_account] section of a Streamlit secrets.toml."""
+    with open(path, "rb") as f:
+        secrets = tomllib.load(f)
+    if "google_service_account" not in secrets:
+        raise ValueError(f"Missing [google_service_account] section in {path}.")
+    return validated_sa_info(secrets["google_service_account"])
+
+
+def serve(socket_path: str, sa_info: dict, batch_window_s: float):
+    sidecar = Sidecar(build_client(sa_info), batch_window_s)
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)  # left behind by a sidecar that did not shut down cleanly
+        else:
+            raise SystemExit(f"another sidecar is already listening on {socket_path}")
+        finally:
+            probe.close()
+    with _Server(socket_path, _Handler) as server:
+        server.sidecar = sidecar
+        os.chmod(socket_path, 0o660)
+        logger.info("Serving Sheets requests on %s", socket_path)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.environ.get("GTN_SIDECAR_SOCKET"),
+                        help="Unix socket to listen on (default: $GTN_SIDECAR_SOCKET)")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"),
+                        help="Streamlit secrets file with the [google_service_account] section")
+    parser.add_argument("--batch-window-ms", type=int, default=BATCH_WINDOW_MS,
+                        help="how long an append waits for others to the same range")
+    parser.add_argument("--stats", action="store_true", help="print the running sidecar's counters and exit")
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("--socket is required when GTN_SIDECAR_SOCKET is not set")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if args.stats:
+        try:
+            stats = SidecarClient(args.socket, fallback=None).stats()
+        except OSError as e:
+            raise SystemExit(f"no sidecar is listening on {args.socket}: {e}")
+        json.dump(stats, sys.stdout, indent=2, sort_keys=True)
+        print()
+        return
+    serve(args.socket, load_secrets(args.secrets), args.batch_window_ms / 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""The columnar ingest path must rank exactly like the row-by-row one.
+
+    python -m pytest test_leaderboard.py
+
+Each index is built twice from the same rows, once through add() and once
+through add_columns(), and the two are compared through their public
+readers. The rows mix in the sheet's oddities: short rows, attempt counts
+int() rejects or reads differently, replayed score IDs, unparsable
+timestamps and many ties around the top-K cutoff.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from leaderboard import (
+    SECONDS_PER_DAY,
+    DailyRollups,
+    PlayerBests,
+    RankIndex,
+    TopScores,
+    _int_or_zero,
+    _to_int64,
+    parse_columns,
+    parse_epoch,
+    parse_row,
+    top_k_indices,
+)
+
+NOW = parse_epoch("2024-03-10T12:00:00")
+ATTEMPTS = ["1", "2", "3", "3", "4", "7", "10", "", "oops", " 5", "+2", "-1", "1_0", "٣", "007", "3.0"]
+TIMESTAMPS = [
+    "2024-03-10T08:00:00", "2024-03-10T08:00:00", "2024-03-10 09:30:00", "2024-03-09T23:59:59",
+    "2024-03-08T00:00", "2024-03-05", "2024-03-04T10:00:00", "2024-02-01T00:00:00",
+    "2024-03-09T12:00:00Z", "2024-03-09T14:00:00+02:00", "today", "2024", "20240309", "2024-02-30", "",
+]
+# Values NumPy's datetime64 parses but parse_epoch() rejects. A batch with a
+# malformed timestamp is parsed differently, so they also get rows of their own.
+NUMPY_ONLY_TIMESTAMPS = ["2024-03-10T08:00:00", "2024-03-09 23:59:59", "today", "now", "2024", "2024-03"]
+
+
+def make_rows(n: int, seed: int, timestamps: list = TIMESTAMPS) -> list:
+    """Sheet-like rows with few distinct values, so scores tie often."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        row = [f"player{rng.randrange(12)}", rng.choice(ATTEMPTS), rng.choice(timestamps), f"id{i}"]
+        roll = rng.random()
+        if roll < 0.05:
+            row = row[:rng.randrange(4)]  # short rows, down to empty ones
+        elif roll < 0.1:
+            row[3] = ""  # written before score IDs existed
+        elif roll < 0.2 and rows:
+            row = list(rng.choice(rows))  # replayed append
+        rows.append(row)
+    return rows
+
+
+def build_row_by_row(rows: list, indexes):
+    seen_ids = set()
+    for r in rows:
+        score = parse_row(r, seen_ids)
+        if score is not None:
+            for index in indexes:
+                index.add(score)
+
+
+def build_columnar(rows: list, indexes):
+    columns = parse_columns(rows, set())
+    for index in indexes:
+        index.add_columns(columns)
+
+
+ROWS = [
+    *(make_rows(n, seed) for n, seed in [(0, 0), (1, 1), (40, 2), (500, 3), (3000, 4)]),
+    make_rows(500, 5, NUMPY_ONLY_TIMESTAMPS),
+]
+
+
+@pytest.mark.parametrize("rows", ROWS)
+@pytest.mark.parametrize("capacity", [1, 5, 50, 10_000])
+def test_top_scores(rows, capacity):
+    by_row, by_column = TopScores(capacity), TopScores(capacity)
+    build_row_by_row(rows, [by_row])
+    build_columnar(rows, [by_column])
+    assert by_column.snapshot() == by_row.snapshot()
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_rank_index(rows):
+    by_row, by_column = RankIndex(max_attempts=8), RankIndex(max_attempts=8)
+    build_row_by_row(rows, [by_row])
+    build_columnar(rows, [by_column])
+    assert by_column.total == by_row.total
+    for attempts in range(-1, 11):
+        for timestamp in ["", *TIMESTAMPS, "9999"]:
+            assert by_column.rank(attempts, timestamp) == by_row.rank(attempts, timestamp)
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_player_bests(rows):
+    by_row, by_column = PlayerBests(), PlayerBests()
+    build_row_by_row(rows, [by_row])
+    build_columnar(rows, [by_column])
+    assert by_column.snapshot() == by_row.snapshot()
+    for name in ["", "nobody", *(f"player{i}" for i in range(12))]:
+        assert by_column.best(name) == by_row.best(name)
+        assert by_column.rank(name) == by_row.rank(name)
+
+
+@pytest.mark.parametrize("rows", ROWS)
+@pytest.mark.parametrize("capacity", [1, 3, 1000])
+@pytest.mark.parametrize("retain_days", [7, 100_000])
+def test_daily_rollups(rows, capacity, retain_days):
+    by_row = DailyRollups(capacity, retain_days, clock=lambda: NOW)
+    by_column = DailyRollups(capacity, retain_days, clock=lambda: NOW)
+    build_row_by_row(rows, [by_row])
+    build_columnar(rows, [by_column])
+    today = NOW // SECONDS_PER_DAY
+    for first_day, last_day in [(today, today), (today - 1, today), (today - 6, today), (0, today + 100_000)]:
+        for per_player in [False, True]:
+            expected = by_row.top(first_day, last_day, 20, per_player)
+            assert by_column.top(first_day, last_day, 20, per_player) == expected
+
+
+def test_daily_rollups_drop_days_outside_the_window():
+    clock = [NOW]
+    rollups = DailyRollups(10, retain_days=2, clock=lambda: clock[0])
+    build_row_by_row([["a", "3", "2024-03-01T00:00:00", "old"], ["b", "4", "2024-03-10T00:00:00", "new"]], [rollups])
+    today = NOW // SECONDS_PER_DAY
+    assert [s.score_id for s in rollups.top(today - 30, today, 10)] == ["new"]
+    clock[0] += 2 * SECONDS_PER_DAY
+    build_row_by_row([["c", "5", "2024-03-12T00:00:00", "later"]], [rollups])
+    assert [s.score_id for s in rollups.top(today - 30, today + 2, 10)] == ["later"]
+
+
+def test_to_int64_matches_int():
+    values = [*ATTEMPTS, "0", "9" * 18, "-" + "9" * 18, "１２", " ", "\t7\n", "1e3", "0x10", "12a", "a12"]
+    assert _to_int64(values).tolist() == [_int_or_zero(v) for v in values]
+    assert _to_int64([]).tolist() == []
+    assert _to_int64(["", ""]).tolist() == [0, 0]
+
+
+@pytest.mark.parametrize("k", [0, 1, 3, 7, 8, 9, 100])
+def test_top_k_indices_breaks_ties_by_position(k):
+    rng = random.Random(k)
+    attempts = np.array([rng.choice([1, 2, 2, 2, 3]) for _ in range(60)], dtype=np.int64)
+    timestamps = np.array([rng.choice(["a", "b", "b", "c"]) for _ in range(60)], dtype=str)
+    expected = sorted(range(60), key=lambda i: (attempts[i], timestamps[i], i))[:k]
+    assert top_k_indices(attempts, timestamps, k).tolist() == expected
+
@@ -0,0 +1,255 @@
+"""Behaviour of the score log, the shared row cache and the leaderboard state.
+
+    python -m pytest test_score_store.py
+
+Sheets is replaced by an in-memory sheet, and every SQLite file lives in a
+fresh temporary directory, so no credentials are needed.
+"""
+import re
+import threading
+import time
+
+import pytest
+
+import score_store
+from score_store import (
+    BREAKER_FAILURES,
+    GENERATION_TAB,
+    LEADERBOARD_TTL_S,
+    CircuitBreaker,
+    CircuitOpenError,
+    LeaderboardState,
+    ScoreLog,
+    ScoreWriter,
+    SharedRows,
+)
+from sheets import a1
+
+HEADER = ["Name", "Attempts", "Timestamp", "Score ID", "Difficulty"]
+
+
+def score(i: int, attempts: int = 5) -> list:
+    return [f"player{i}", str(attempts), f"2024-03-10T08:00:{i % 60:02d}", f"id{i}", "Easy"]
+
+
+class FakeSheet:
+    """One score tab plus its generation, answering get_values() like Sheets does.
+
+    ``calls`` records every range read. While ``gate`` is set, reads of the
+    score rows wait for it to be opened.
+    """
+
+    def __init__(self, tab: str, rows: list):
+        self.tab = tab
+        self.rows = [HEADER, *rows]
+        self.calls = []
+        self.gate = None
+
+    def get_values(self, range_name: str) -> dict:
+        self.calls.append(range_name)
+        if range_name == a1(GENERATION_TAB, "A2:B"):
+            return {"values": [[self.tab, f"{len(self.rows)}/{self.rows[-1][3]}"]]}
+        first = int(re.fullmatch(re.escape(a1(self.tab, "A")) + r"(\d+):E", range_name).group(1))
+        if self.gate is not None:
+            self.gate.wait()
+        rows = self.rows[first - 1:]
+        return {"range": range_name, "values": rows} if rows else {"range": range_name}
+
+    def row_reads(self) -> list:
+        return [call for call in self.calls if call != a1(GENERATION_TAB, "A2:B")]
+
+
+@pytest.fixture(autouse=True)
+def no_quota(monkeypatch):
+    """Skip the process-wide token buckets and retries."""
+    monkeypatch.setattr(score_store, "execute_sheets_request", lambda call, kind: call())
+
+
+@pytest.fixture
+def sheet():
+    return FakeSheet("Easy", [score(i) for i in range(5)])
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "rows.sqlite3")
+
+
+def test_resubmitted_score_is_written_once(tmp_path):
+    sent = []
+    writer = ScoreWriter(ScoreLog(str(tmp_path / "log.sqlite3")), lambda difficulty, rows: sent.extend(rows),
+                         interval_s=0.01)
+    assert writer.submit(score(1))
+    assert writer.submit(score(1))  # e.g. the player pressed submit twice
+    writer.close()
+    assert sent == [score(1)]
+
+
+def test_replay_after_a_crash_lands_once(tmp_path):
+    path = str(tmp_path / "log.sqlite3")
+    log = ScoreLog(path)
+    for i in range(3):
+        assert log.append(score(i))  # logged, then the process died before the writer flushed
+
+    def unavailable(difficulty, rows):
+        raise RuntimeError("Sheets unavailable")
+
+    ScoreWriter(ScoreLog(path), unavailable, interval_s=0.01).close()
+    assert ScoreLog(path).backlog() == 3
+    sent = []
+    ScoreWriter(ScoreLog(path), lambda difficulty, rows: sent.append((difficulty, rows)), interval_s=0.01).close()
+    ScoreWriter(ScoreLog(path), lambda difficulty, rows: sent.append((difficulty, rows)), interval_s=0.01).close()
+    assert sent == [("Easy", [score(0), score(1), score(2)])]
+    assert ScoreLog(path).backlog() == 0
+    assert ScoreLog(path).cursor() == 3
+
+
+def test_circuit_breaker_probes_once_per_cooldown():
+    breaker = CircuitBreaker(threshold=2, cooldown_s=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()  # the probe
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+def test_shared_rows_only_stores_rows_that_continue_the_copy(cache_path):
+    shared = SharedRows(cache_path)
+    assert shared.cursor("Easy") == 1
+    assert shared.store("Easy", 2, [score(0), score(1)], refreshed=True, generation="3/id1")
+    assert shared.store("Easy", 2, [score(0), score(1), score(2)])  # overlaps; only row 4 is new
+    assert not shared.store("Easy", 10, [score(9)])  # rows 5-9 are missing
+    assert shared.cursor("Easy") == 4
+    rows, refreshed_at, error = SharedRows(cache_path).read("Easy", 3)
+    assert rows == [score(1), score(2)]
+    assert refreshed_at is not None and error is None
+
+
+def test_shared_rows_unchanged_only_matches_a_recent_fetch(cache_path):
+    shared = SharedRows(cache_path)
+    assert not shared.unchanged("Easy", "3/id1", 60)  # never fetched
+    shared.store("Easy", 2, [score(0), score(1)], refreshed=True, generation="3/id1")
+    assert not shared.unchanged("Easy", "4/id2", 60)
+    assert not shared.unchanged("Easy", "3/id1", 0)
+    assert shared.unchanged("Easy", "3/id1", 60)
+
+
+def test_idle_refresh_reads_only_the_generation(sheet, cache_path):
+    state = LeaderboardState("Easy", SharedRows(cache_path))
+    state.refresh(lambda: sheet)
+    assert state.ranks.total == 5
+    sheet.calls.clear()
+    state.refresh(lambda: sheet)
+    assert sheet.calls == [a1(GENERATION_TAB, "A2:B")]
+    sheet.rows.append(score(5))
+    state.refresh(lambda: sheet)
+    assert sheet.row_reads() == [a1("Easy", "A7:E")]
+    assert state.ranks.total == 6
+
+
+def test_two_states_share_one_fetch(sheet, cache_path):
+    """Two processes on a host: the second ingests what the first read."""
+    first = LeaderboardState("Easy", SharedRows(cache_path))
+    second = LeaderboardState("Easy", SharedRows(cache_path))
+    first.refresh(lambda: sheet)
+
+    def no_client():
+        raise AssertionError("the shared copy is fresh; Sheets should not be needed")
+
+    second.refresh(no_client, max_age=LEADERBOARD_TTL_S)
+    assert len(sheet.row_reads()) == 1
+    assert second.ranks.total == 5
+    assert second.top(5).to_pylist() == first.top(5).to_pylist()
+
+
+def test_concurrent_refreshes_share_one_fetch(sheet, cache_path):
+    state = LeaderboardState("Easy", SharedRows(cache_path))
+    sheet.gate = threading.Event()
+    errors = []
+
+    def refresh():
+        try:
+            state.refresh(lambda: sheet)
+        except Exception as e:
+            errors.append(e)
+
+    callers = [threading.Thread(target=refresh) for _ in range(4)]
+    for caller in callers:
+        caller.start()
+    time.sleep(0.1)  # let them all queue behind the first
+    sheet.gate.set()
+    for caller in callers:
+        caller.join()
+    assert errors == []
+    assert sheet.row_reads() == [a1("Easy", "A2:E")]
+    assert state.ranks.total == 5
+
+
+def test_record_append_seeds_the_cursor(sheet, cache_path):
+    state = LeaderboardState("Easy", SharedRows(cache_path))
+    state.record_append(sheet.rows[1:3], {"updates": {"updatedRange": "'Easy'!A2:E3"}})
+    assert state.rows_ingested == 3
+    assert state.shared.cursor("Easy") == 3
+    state.record_append([score(9)], {"updates": {"updatedRange": "'Easy'!A9:E9"}})  # someone else's rows in between
+    assert state.rows_ingested == 3
+    state.refresh(lambda: sheet)
+    assert sheet.row_reads() == [a1("Easy", "A4:E")]
+    assert state.ranks.total == 5
+
+
+def test_snapshot_restores_the_state_and_its_age(sheet, tmp_path):
+    snapshot_path = str(tmp_path / "easy.snapshot")
+    state = LeaderboardState("Easy", SharedRows(str(tmp_path / "one.sqlite3")), snapshot_path)
+    state.refresh(lambda: sheet)
+    state._refreshed_at -= 1000  # last read long ago, though saved just now
+    state.save_snapshot()
+
+    restored = LeaderboardState("Easy", SharedRows(str(tmp_path / "two.sqlite3")), snapshot_path)
+    assert restored.load_snapshot()
+    assert restored.rows_ingested == 6
+    assert restored.top(10).to_pylist() == state.top(10).to_pylist()
+    assert restored.age() >= 1000
+    sheet.calls.clear()
+    sheet.rows.append(score(5))
+    restored.refresh(lambda: sheet, max_age=LEADERBOARD_TTL_S)
+    assert sheet.row_reads() == [a1("Easy", "A2:E")]  # its shared copy is empty, not its cursor
+    assert restored.ranks.total == 6  # the rows it already had are not counted twice
+
+
+def test_snapshot_of_another_tab_is_ignored(tmp_path):
+    snapshot_path = str(tmp_path / "easy.snapshot")
+    LeaderboardState("Easy", SharedRows(str(tmp_path / "rows.sqlite3")), snapshot_path).save_snapshot()
+    assert not LeaderboardState("Hard", SharedRows(str(tmp_path / "rows.sqlite3")), snapshot_path).load_snapshot()
+
+
+def test_open_breaker_skips_the_client_and_the_lock(cache_path):
+    state = LeaderboardState("Easy", SharedRows(cache_path))
+    builds = []
+
+    def failing_client():
+        builds.append(None)
+        raise RuntimeError("no credentials")
+
+    for _ in range(BREAKER_FAILURES):
+        with pytest.raises(RuntimeError):
+            state.refresh(failing_client)
+    assert state.last_error is not None
+    outcome = []
+
+    def refresh():
+        try:
+            state.refresh(failing_client)
+        except Exception as e:
+            outcome.append(e)
+
+    with SharedRows(cache_path).refresher("Easy"):  # another process is reading the tab
+        caller = threading.Thread(target=refresh)
+        caller.start()
+        caller.join(timeout=5)
+        assert not caller.is_alive()  # did not wait for the refresher lock
+    assert [type(e) for e in outcome] == [CircuitOpenError]
+    assert len(builds) == BREAKER_FAILURES
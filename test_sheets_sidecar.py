@@ -0,0 +1,210 @@
+"""Behaviour of the Sheets sidecar: append batching, its read cache, errors and the socket protocol.
+
+    python -m pytest test_sheets_sidecar.py
+
+The sidecar runs against a fake in-memory client, so no Google libraries or
+credentials are needed.
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+import pytest
+
+import sheets_sidecar
+from sheets import SheetsHTTPError, SidecarClient, recv_message, send_message
+from sheets_sidecar import AppendBatcher, Sidecar, _narrowed, _Handler, _Server
+
+
+class FakeClient:
+    """Records every call; get_values answers from ``values``, appends land below the rows already there."""
+
+    def __init__(self):
+        self.calls = []
+        self.values = {}  # range name -> rows
+        self.rows = {}  # tab -> rows appended so far
+        self.error = None  # raised by the next call, if set
+
+    def _call(self, *call):
+        self.calls.append(call)
+        if self.error is not None:
+            raise self.error
+
+    def get_values(self, range_name: str) -> dict:
+        self._call("get_values", range_name)
+        return {"range": range_name, "values": self.values.get(range_name, [])}
+
+    def update_values(self, range_name: str, rows: list, value_input_option: str = "RAW") -> dict:
+        self._call("update_values", range_name, rows, value_input_option)
+        return {"updatedRange": range_name}
+
+    def append_values(self, range_name: str, rows: list) -> dict:
+        self._call("append_values", range_name, rows)
+        sheet = range_name.rsplit("!", 1)[0]
+        stored = self.rows.setdefault(sheet, [])
+        first = len(stored) + 2  # below the header row
+        stored.extend(rows)
+        return {"updates": {"updatedRange": f"{sheet}!A{first}:E{first + len(rows) - 1}", "updatedRows": len(rows)}}
+
+
+@pytest.fixture(autouse=True)
+def no_quota(monkeypatch):
+    """Skip the process-wide token buckets, which would make the tests wait on each other."""
+    monkeypatch.setattr(sheets_sidecar, "execute_sheets_request", lambda call, kind: call())
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def served(client):
+    """A sidecar for ``client`` listening on a fresh socket; yields the socket path."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "sheets.sock")
+    server = _Server(path, _Handler)
+    server.sidecar = Sidecar(client, batch_window_s=0.0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(directory)
+
+
+def test_narrowed_slices_the_append_response():
+    result = {"spreadsheetId": "s", "updates": {"updatedRange": "'Easy'!A10:E14", "updatedRows": 5, "updatedCells": 25}}
+    narrowed = _narrowed(result, 2, 2)
+    assert narrowed["updates"]["updatedRange"] == "'Easy'!A12:E13"
+    assert narrowed["updates"]["updatedRows"] == 2
+    assert narrowed["spreadsheetId"] == "s"
+    assert result["updates"]["updatedRange"] == "'Easy'!A10:E14"  # the shared response is left alone
+
+
+def test_narrowed_single_cell_and_missing_range():
+    assert _narrowed({"updates": {"updatedRange": "Sheet1!A7"}}, 0, 1)["updates"]["updatedRange"] == "Sheet1!A7:A7"
+    assert _narrowed({}, 3, 2) == {"updates": {"updatedRows": 2}}
+
+
+def test_appends_within_the_window_are_sent_once(client):
+    batcher = AppendBatcher(client.append_values, window_s=0.3)
+    results = {}
+    callers = [
+        threading.Thread(target=lambda i=i: results.__setitem__(i, batcher.append("'Easy'!A:E", [[f"p{i}"]] * (i + 1))))
+        for i in range(3)
+    ]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert len(client.calls) == 1
+    assert len(client.calls[0][2]) == 6
+    # Each caller gets back its own rows, and together they cover the batch without overlap
+    covered = []
+    for i, result in results.items():
+        assert result["updates"]["updatedRows"] == i + 1
+        first, last = (int(cell.lstrip("A").lstrip("E")) for cell in result["updates"]["updatedRange"].split("!")[1].split(":"))
+        assert last - first == i
+        covered.extend(range(first, last + 1))
+    assert sorted(covered) == list(range(2, 8))
+
+
+def test_a_failed_batch_fails_every_caller(client):
+    client.error = SheetsHTTPError(503, "unavailable")
+    batcher = AppendBatcher(client.append_values, window_s=0.3)
+    errors = []
+
+    def append():
+        try:
+            batcher.append("'Easy'!A:E", [["p"]])
+        except SheetsHTTPError as e:
+            errors.append(e)
+
+    callers = [threading.Thread(target=append) for _ in range(2)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert len(client.calls) == 1
+    assert [e.status for e in errors] == [503, 503]
+
+
+def test_reads_are_cached_until_a_write_to_the_tab(client):
+    sidecar = Sidecar(client, batch_window_s=0.0)
+    client.values["'Easy'!A2:E"] = [["p", "3"]]
+    for _ in range(3):
+        assert sidecar.handle({"op": "get_values", "args": ["'Easy'!A2:E"]}) == {
+            "result": {"range": "'Easy'!A2:E", "values": [["p", "3"]]}
+        }
+    assert len(client.calls) == 1
+    sidecar.handle({"op": "get_values", "args": ["'Hard'!A2:E"]})
+    sidecar.handle({"op": "update_values", "args": ["'Easy'!A1:E1", [["h"]]]})
+    sidecar.handle({"op": "get_values", "args": ["'Easy'!A2:E"]})
+    sidecar.handle({"op": "get_values", "args": ["'Hard'!A2:E"]})
+    assert [call[1] for call in client.calls if call[0] == "get_values"] == [
+        "'Easy'!A2:E", "'Hard'!A2:E", "'Easy'!A2:E"
+    ]
+
+
+def test_an_append_drops_every_cached_read(client):
+    """Formulas on other tabs, like the app's generations, change with the appended tab."""
+    sidecar = Sidecar(client, batch_window_s=0.0)
+    sidecar.handle({"op": "get_values", "args": ["'Generations'!A2:B"]})
+    sidecar.handle({"op": "append_values", "args": ["'Easy'!A:E", [["p", "3"]]]})
+    sidecar.handle({"op": "get_values", "args": ["'Generations'!A2:B"]})
+    assert [call[1] for call in client.calls if call[0] == "get_values"] == ["'Generations'!A2:B"] * 2
+
+
+@pytest.mark.parametrize("request_", [
+    {"op": "get_values", "args": []},
+    {"op": "get_values", "args": ["a", "b", "c"]},
+    {"op": "get_values", "args": "'Easy'!A2:E"},
+    {"op": "drop_table", "args": []},
+])
+def test_malformed_requests_are_not_retryable(client, request_):
+    reply = Sidecar(client).handle(request_)
+    assert reply["error"]["status"] == 400
+    assert client.calls == []
+
+
+def test_errors_keep_the_api_status_and_message(client):
+    client.error = SheetsHTTPError(400, "Unable to parse range", retry_after=0.0)
+    reply = Sidecar(client).handle({"op": "get_values", "args": ["'Nope'!A1"]})
+    assert reply == {"error": {"status": 400, "message": "Unable to parse range", "retry_after": 0.0}}
+
+
+def test_network_errors_are_retryable(client):
+    client.error = ConnectionResetError("reset")
+    assert Sidecar(client).handle({"op": "get_values", "args": ["'Easy'!A2:E"]})["error"]["status"] == 503
+
+
+def test_round_trip_over_the_socket(client, served):
+    client.values["'Easy'!A2:E"] = [["p", "3"]]
+    remote = SidecarClient(served, fallback=None)
+    assert remote.get_values("'Easy'!A2:E")["values"] == [["p", "3"]]
+    assert remote.append_values("'Easy'!A:E", [["q", "4"]])["updates"]["updatedRange"] == "'Easy'!A2:E2"
+    assert remote.stats()["requests.get_values"] == 1
+
+
+def test_api_errors_arrive_once_prefixed(client, served):
+    client.error = SheetsHTTPError(400, "Unable to parse range")
+    with pytest.raises(SheetsHTTPError) as raised:
+        SidecarClient(served, fallback=None).get_values("'Nope'!A1")
+    assert raised.value.status == 400
+    assert str(raised.value) == "HTTP 400: Unable to parse range"
+
+
+def test_malformed_request_over_the_socket(served):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(served)
+        send_message(sock, {"op": "get_values"})
+        assert recv_message(sock)["error"]["status"] == 400
+
+
+def test_unreachable_sidecar_falls_back_to_the_local_client(client):
+    remote = SidecarClient(os.path.join(tempfile.gettempdir(), "no-such-sidecar.sock"), fallback=lambda: client)
+    assert remote.get_values("'Easy'!A2:E") == {"range": "'Easy'!A2:E", "values": []}
+    assert client.calls == [("get_values", "'Easy'!A2:E")]